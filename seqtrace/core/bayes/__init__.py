@@ -0,0 +1,39 @@
+# Copyright (C) 2014 Brian J. Stucky
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+
+# Sets up a reference to a compiled implementation of the Bayesian consensus
+# algorithm, if one is available.  The Cython extension module (cbayes) is used if
+# it has been built; otherwise, the Numba JIT-compiled module is tried, which
+# requires both NumPy and Numba.  If neither can be loaded, bayesianConsensus is
+# set to None, and ConsensSeqBuilder falls back to its own NumPy or native Python
+# implementation.  The window scan for quality trimming, findTrimWindows, is only
+# implemented with Numba and is likewise None if it cannot be loaded.
+
+try:
+    # Try to load the compiled Cython module.
+    from cbayes import bayesianConsensus
+except ImportError:
+    try:
+        # If that fails, try the Numba module.
+        from nbbayes import bayesianConsensus
+    except ImportError:
+        bayesianConsensus = None
+
+try:
+    from nbbayes import findTrimWindows
+except ImportError:
+    findTrimWindows = None
@@ -0,0 +1,175 @@
+# Copyright (C) 2014 Brian J. Stucky
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+
+# A Cython implementation of the column loop of the Bayesian consensus algorithm.
+# It has the same interface as the Numba implementation in nbbayes.py.  To compile
+# it, see setup.py.
+
+cimport cython
+from libc.math cimport log10, pow
+
+import numpy
+
+
+cdef enum:
+    GAP = 45        # '-'
+    NOCALL = 78     # 'N'
+    SPACE = 32      # ' '
+
+# Lookup tables indexed by character code.  For each nucleotide code,
+# basecode_members marks the bases represented by the code, in the order 'A', 'T',
+# 'G', 'C', and basecode_counts gives the number of bases represented.  Character
+# codes that are not nucleotide codes represent no bases.  usable_codes identifies
+# the base calls with usable data; gaps and 'N's are the only unusable codes.
+cdef unsigned char basecode_members[256][4]
+cdef int basecode_counts[256]
+cdef bint usable_codes[256]
+
+# The error probabilities for all 1-byte confidence scores.  The probability for
+# score s is at index s + 128.
+cdef double error_probs[384]
+
+cdef void initBaseCodeTables():
+    basecodes = {
+            'A': 'A', 'T': 'T', 'G': 'G', 'C': 'C',
+            'W': 'AT', 'S': 'CG', 'M': 'AC', 'K': 'GT', 'R': 'AG', 'Y': 'CT',
+            'B': 'CGT', 'D': 'AGT', 'H': 'ACT', 'V': 'ACG'}
+    cdef int code, base
+
+    for code in range(256):
+        basecode_counts[code] = 0
+        for base in range(4):
+            basecode_members[code][base] = 0
+        usable_codes[code] = code != GAP and code != NOCALL
+
+    for code in range(384):
+        error_probs[code] = pow(10.0, (code - 128) / -10.0)
+
+    for codechar, codebases in basecodes.items():
+        for basechar in codebases:
+            basecode_members[ord(codechar)][u'ATGC'.index(basechar)] = 1
+        basecode_counts[ord(codechar)] = len(codebases)
+
+initBaseCodeTables()
+
+cdef unsigned char *base_chars = b'ATGC'
+
+
+@cython.cdivision(True)
+cdef inline void defineBasePrDist(unsigned char basecall, short score, double *dist):
+    """
+    Defines a nucleotide probability distribution in the 4-element array dist
+    from a base call character code and Phred-type quality score.
+    """
+    cdef double eprob
+    if score >= -128 and score <= 255:
+        eprob = error_probs[score + 128]
+    else:
+        eprob = pow(10.0, score / -10.0)
+    cdef int count = basecode_counts[basecall]
+    cdef int base
+
+    for base in range(4):
+        if basecode_members[basecall][base]:
+            dist[base] = (1 - eprob) / count
+        else:
+            dist[base] = eprob / (4 - count)
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+def bayesianConsensus(const unsigned char[:] bases1, const short[:] scores1,
+        const unsigned char[:] bases2, const short[:] scores2, const double[:] gapflankscores,
+        double min_confscore):
+    """
+    Calculates a consensus sequence from two aligned sequences.  The base calls
+    are given as uint8 arrays of character codes and the quality scores as
+    int16 arrays.  For each column with an internal gap in one of the
+    sequences, gapflankscores should contain the mean score of the bases flanking
+    the gap; all other values should be -1.  Returns the consensus sequence as a
+    uint8 array of character codes and an array of consensus quality scores.
+    """
+    cdef Py_ssize_t numcols = bases1.shape[0]
+    cdef Py_ssize_t cnt
+    cdef int base, maxbase
+    cdef unsigned char base1, base2, cbase
+    cdef bint usable1, usable2
+    cdef double cscore, gapflankscore, denom
+    cdef double prior[4]
+    cdef double nppd[4]
+
+    cons_arr = numpy.empty(numcols, dtype=numpy.uint8)
+    consconf_arr = numpy.empty(numcols, dtype=numpy.float64)
+    cdef unsigned char[:] cons = cons_arr
+    cdef double[:] consconf = consconf_arr
+
+    for cnt in range(numcols):
+        base1 = bases1[cnt]
+        base2 = bases2[cnt]
+        usable1 = usable_codes[base1]
+        usable2 = usable_codes[base2]
+
+        gapflankscore = -1.0
+        if usable1 and usable2:
+            # Calculate the posterior probability distribution of nucleotides
+            # using Bayes' Theorem, then find the most probable base.
+            defineBasePrDist(base1, scores1[cnt], prior)
+            defineBasePrDist(base2, scores2[cnt], nppd)
+            denom = 0.0
+            for base in range(4):
+                nppd[base] *= prior[base]
+                denom += nppd[base]
+            maxbase = 0
+            for base in range(4):
+                nppd[base] /= denom
+                if nppd[base] > nppd[maxbase]:
+                    maxbase = base
+
+            if nppd[maxbase] > 0:
+                cscore = -10.0 * log10(1.0 - nppd[maxbase])
+            else:
+                cscore = 0.0
+            # See ConsensSeqBuilder.getMostProbableBase() for why this is needed.
+            cscore += 0.000001
+            cbase = base_chars[maxbase]
+        elif usable1:
+            cbase = base1
+            cscore = scores1[cnt]
+            gapflankscore = gapflankscores[cnt]
+        elif usable2:
+            cbase = base2
+            cscore = scores2[cnt]
+            gapflankscore = gapflankscores[cnt]
+        elif base1 == GAP and base2 == GAP:
+            # A gap in both sequences due to the primer alignment.
+            cbase = SPACE
+            cscore = 0.0
+        else:
+            # Neither trace has usable data.
+            cbase = NOCALL
+            cscore = 1.0
+
+        if cscore < min_confscore and cbase != SPACE:
+            if gapflankscore > min_confscore:
+                # A spurious gap, so delete the position.
+                cbase = SPACE
+            else:
+                cbase = NOCALL
+        cons[cnt] = cbase
+        consconf[cnt] = cscore
+
+    return (cons_arr, consconf_arr)
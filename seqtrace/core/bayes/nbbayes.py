@@ -0,0 +1,185 @@
+# Copyright (C) 2014 Brian J. Stucky
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+
+# A Numba implementation of the column loop of the Bayesian consensus algorithm.
+# The base calls are passed as arrays of character codes and the quality scores
+# as arrays of integers, so the entire loop can be JIT-compiled to machine code.
+
+import numpy
+from numba import njit
+
+
+# The bases represented by each nucleotide code.  Bases are numbered in the order
+# 'A', 'T', 'G', 'C', which is the order used by ConsensSeqBuilder.
+basecodes = {
+        'A': 'A', 'T': 'T', 'G': 'G', 'C': 'C',
+        'W': 'AT', 'S': 'CG', 'M': 'AC', 'K': 'GT', 'R': 'AG', 'Y': 'CT',
+        'B': 'CGT', 'D': 'AGT', 'H': 'ACT', 'V': 'ACG'}
+
+# Lookup tables indexed by character code.  For each code, basecode_members marks
+# the bases represented by the code, and basecode_counts gives the number of bases
+# represented.  Character codes that are not nucleotide codes represent no bases.
+basecode_members = numpy.zeros((256, 4), dtype=numpy.uint8)
+basecode_counts = numpy.zeros(256, dtype=numpy.int64)
+for code, codebases in basecodes.items():
+    for base in codebases:
+        basecode_members[ord(code), 'ATGC'.index(base)] = 1
+    basecode_counts[ord(code)] = len(codebases)
+
+# A lookup table, indexed by character code, that identifies the base calls with
+# usable data.  Gaps and 'N's are the only unusable codes.
+usable_codes = numpy.ones(256, dtype=numpy.uint8)
+usable_codes[[ord('-'), ord('N')]] = 0
+
+# The error probabilities for all 1-byte confidence scores.  The probability for
+# score s is at index s + 128.
+error_probs = numpy.array([10.0 ** (score / -10.0) for score in range(-128, 256)])
+
+base_chars = numpy.frombuffer('ATGC', dtype=numpy.uint8)
+
+GAP = ord('-')
+NOCALL = ord('N')
+SPACE = ord(' ')
+
+
+@njit(cache=True)
+def defineBasePrDist(basecall, score, dist):
+    """
+    Defines a nucleotide probability distribution in the 4-element array dist
+    from a base call character code and Phred-type quality score.  The probability
+    of a correct call is split among the bases represented by the call, and the
+    error probability is split among the remaining bases.
+    """
+    if score >= -128 and score <= 255:
+        eprob = error_probs[score + 128]
+    else:
+        eprob = 10.0 ** (score / -10.0)
+    count = basecode_counts[basecall]
+    for base in range(4):
+        if basecode_members[basecall, base]:
+            dist[base] = (1 - eprob) / count
+        else:
+            dist[base] = eprob / (4 - count)
+
+@njit(cache=True)
+def bayesianConsensus(bases1, scores1, bases2, scores2, gapflankscores, min_confscore):
+    """
+    Calculates a consensus sequence from two aligned sequences.  The base calls
+    are given as uint8 arrays of character codes and the quality scores as
+    int16 arrays.  For each column with an internal gap in one of the
+    sequences, gapflankscores should contain the mean score of the bases flanking
+    the gap; all other values should be -1.  Returns the consensus sequence as a
+    uint8 array of character codes and an array of consensus quality scores.
+    """
+    numcols = bases1.shape[0]
+    cons = numpy.empty(numcols, dtype=numpy.uint8)
+    consconf = numpy.empty(numcols, dtype=numpy.float64)
+    prior = numpy.empty(4, dtype=numpy.float64)
+    nppd = numpy.empty(4, dtype=numpy.float64)
+
+    for cnt in range(numcols):
+        base1 = bases1[cnt]
+        base2 = bases2[cnt]
+        usable1 = usable_codes[base1]
+        usable2 = usable_codes[base2]
+
+        gapflankscore = -1.0
+        if usable1 and usable2:
+            # Calculate the posterior probability distribution of nucleotides
+            # using Bayes' Theorem, then find the most probable base.
+            defineBasePrDist(base1, scores1[cnt], prior)
+            defineBasePrDist(base2, scores2[cnt], nppd)
+            denom = 0.0
+            for base in range(4):
+                nppd[base] *= prior[base]
+                denom += nppd[base]
+            maxbase = 0
+            for base in range(4):
+                nppd[base] /= denom
+                if nppd[base] > nppd[maxbase]:
+                    maxbase = base
+
+            if nppd[maxbase] > 0:
+                cscore = -10.0 * numpy.log10(1.0 - nppd[maxbase])
+            else:
+                cscore = 0.0
+            # See ConsensSeqBuilder.getMostProbableBase() for why this is needed.
+            cscore += 0.000001
+            cbase = base_chars[maxbase]
+        elif usable1:
+            cbase = base1
+            cscore = scores1[cnt]
+            gapflankscore = gapflankscores[cnt]
+        elif usable2:
+            cbase = base2
+            cscore = scores2[cnt]
+            gapflankscore = gapflankscores[cnt]
+        elif base1 == GAP and base2 == GAP:
+            # A gap in both sequences due to the primer alignment.
+            cbase = SPACE
+            cscore = 0.0
+        else:
+            # Neither trace has usable data.
+            cbase = NOCALL
+            cscore = 1.0
+
+        if cscore < min_confscore and cbase != SPACE:
+            if gapflankscore > min_confscore:
+                # A spurious gap, so delete the position.
+                cbase = SPACE
+            else:
+                cbase = NOCALL
+        cons[cnt] = cbase
+        consconf[cnt] = cscore
+
+    return (cons, consconf)
+
+@njit(cache=True)
+def findTrimWindows(good, winsize, basecnt):
+    """
+    Implements the sliding window scan used for quality trimming of consensus
+    sequences.  The array good marks the correctly-called bases of the consensus
+    sequence with all spaces removed.  Returns the start indexes of the first and
+    last windows of winsize bases that contain at least basecnt good bases, or
+    (-1, -1) if there are no such windows.
+    """
+    numbases = good.shape[0]
+
+    # Slide the window from the left end until it contains enough good bases.
+    num_good = 0
+    for index in range(winsize):
+        num_good += good[index]
+    left = 0
+    while num_good < basecnt and left + winsize < numbases:
+        num_good += good[left + winsize]
+        num_good -= good[left]
+        left += 1
+
+    if num_good < basecnt:
+        return (-1, -1)
+
+    # Slide the window from the right end, stopping at the left window.
+    num_good = 0
+    for index in range(numbases - winsize, numbases):
+        num_good += good[index]
+    right = numbases - winsize
+    while num_good < basecnt and right > left:
+        right -= 1
+        num_good += good[right]
+        num_good -= good[right + winsize]
+
+    return (left, right)
@@ -15,12 +15,41 @@
 
 
 from seqtrace.core.align import PairwiseAlignment
+from seqtrace.core.bayes import bayesianConsensus, findTrimWindows
 import seqtrace.core.sequencetrace as sequencetrace
 from observable import Observable
 
 import math
 import re
 
+# NumPy is optional.  If it is available, consensus sequences are calculated with
+# vectorized array operations; otherwise, the native Python implementations are used.
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Confidence scores are stored as 1-byte integers (signed or unsigned) in all
+# supported trace file formats, so the error probabilities for every possible score
+# are calculated in advance.  This table maps each score from -128 to 255 to its
+# error probability.
+error_probs = dict((score, 10.0 ** (score / -10.0)) for score in range(-128, 256))
+
+if numpy is not None:
+    # The error probability table as an array; the probability for score s is at
+    # index s + 128.
+    error_probs_array = numpy.array([error_probs[score] for score in range(-128, 256)])
+
+    # A lookup table, indexed by character code, that identifies the base calls
+    # with usable data.  Gaps and 'N's are the only unusable codes.
+    usable_codes = numpy.ones(256, dtype=bool)
+    usable_codes[[ord('-'), ord('N')]] = False
+
+    # A lookup table, indexed by character code, that gives the index of each
+    # unambiguous base in the order 'A', 'T', 'G', 'C'.  All other codes are -1.
+    base_codes = numpy.empty(256, dtype=numpy.int8)
+    base_codes.fill(-1)
+    base_codes[numpy.frombuffer('ATGC', dtype=numpy.uint8)] = numpy.arange(4)
 
 
 class ConsensSeqSettingsError(Exception):
@@ -53,8 +82,10 @@ class ConsensSeqSettings(Observable):
         self.autotrim_winsize = 10 
         self.autotrim_basecnt = 8
 
-        # A flag to indicate if a setAll() operation is in progress.
+        # A flag to indicate if a setAll() operation is in progress, and a list of
+        # the events that have been deferred until setAll() is finished.
         self.notify_all = True
+        self.deferred_events = []
 
         # Initialize observable events.  The event "settings_change" is triggered whenever 
         # the value of any setting is changed.  The remaining events give notification of
@@ -81,7 +112,7 @@ class ConsensSeqSettings(Observable):
     def setAll(self, min_confscore, consensus_algorithm, do_autotrim, trim_endgaps, trim_primers,
             primermatch_threshold, fwd_primer, rev_primer, do_qualitytrim, qualitytrim_params):
         self.notify_all = False
-        self.change_made = False
+        self.deferred_events = []
 
         try:
             self.setMinConfScore(min_confscore)
@@ -96,19 +127,34 @@ class ConsensSeqSettings(Observable):
             self.setQualityTrimParams(*qualitytrim_params)
         finally:
             self.notify_all = True
-            if self.change_made:
+
+            # Send each of the deferred events only once, followed by a single
+            # "settings_change" event.
+            deferred_events = self.deferred_events
+            self.deferred_events = []
+            for event_name, args in deferred_events:
+                self.notifyObservers(event_name, args)
+            if len(deferred_events) > 0:
                 self.notifyObservers('settings_change', ())
 
-    def notifySettingsChanged(self):
+    def notifySettingsChanged(self, event_name, args=()):
         """
-        Notifies listeners that one or more settings have changed.  If this method
-        is called in the middle of setAll() operation, the notification is deferred
-        until all settings have been changed.
+        Notifies listeners of the specific settings change event event_name, then
+        notifies them that one or more settings have changed.  If this method is
+        called in the middle of a setAll() operation, the notifications are
+        deferred until all settings have been changed, and each event is only
+        sent once.
         """
         if self.notify_all:
+            self.notifyObservers(event_name, args)
             self.notifyObservers('settings_change', ())
         else:
-            self.change_made = True
+            for cnt, (deferred_name, deferred_args) in enumerate(self.deferred_events):
+                if deferred_name == event_name:
+                    self.deferred_events[cnt] = (event_name, args)
+                    break
+            else:
+                self.deferred_events.append((event_name, args))
 
     def getMinConfScore(self):
         return self.min_confscore
@@ -120,8 +166,7 @@ class ConsensSeqSettings(Observable):
         if self.min_confscore != newval:
             oldval = self.min_confscore
             self.min_confscore = newval
-            self.notifyObservers('min_confscore_change', (self.min_confscore, oldval))
-            self.notifySettingsChanged()
+            self.notifySettingsChanged('min_confscore_change', (self.min_confscore, oldval))
 
     def getConsensusAlgorithm(self):
         return self.consensus_algorithm
@@ -132,8 +177,7 @@ class ConsensSeqSettings(Observable):
 
         if self.consensus_algorithm != newval:
             self.consensus_algorithm = newval
-            self.notifyObservers('consensus_algorithm_change', ())
-            self.notifySettingsChanged()
+            self.notifySettingsChanged('consensus_algorithm_change')
 
     def getTrimConsensus(self):
         return self.do_autotrim
@@ -141,8 +185,7 @@ class ConsensSeqSettings(Observable):
     def setTrimConsensus(self, newval):
         if self.do_autotrim != newval:
             self.do_autotrim = newval
-            self.notifyObservers('autotrim_change', ())
-            self.notifySettingsChanged()
+            self.notifySettingsChanged('autotrim_change')
 
     def getDoQualityTrim(self):
         return self.do_qualitytrim
@@ -150,8 +193,7 @@ class ConsensSeqSettings(Observable):
     def setDoQualityTrim(self, newval):
         if self.do_qualitytrim != newval:
             self.do_qualitytrim = newval
-            self.notifyObservers('autotrim_change', ())
-            self.notifySettingsChanged()
+            self.notifySettingsChanged('autotrim_change')
 
     def getQualityTrimParams(self):
         return (self.autotrim_winsize, self.autotrim_basecnt)
@@ -163,8 +205,7 @@ class ConsensSeqSettings(Observable):
         if (self.autotrim_winsize != windowsize) or (self.autotrim_basecnt != basecount):
             self.autotrim_winsize = windowsize
             self.autotrim_basecnt = basecount
-            self.notifyObservers('autotrim_change', ())
-            self.notifySettingsChanged()
+            self.notifySettingsChanged('autotrim_change')
 
     def getTrimEndGaps(self):
         return self.trim_endgaps
@@ -172,8 +213,7 @@ class ConsensSeqSettings(Observable):
     def setTrimEndGaps(self, newval):
         if self.trim_endgaps != newval:
             self.trim_endgaps = newval
-            self.notifyObservers('autotrim_change', ())
-            self.notifySettingsChanged()
+            self.notifySettingsChanged('autotrim_change')
 
     def getTrimPrimers(self):
         return self.trim_primers
@@ -181,8 +221,7 @@ class ConsensSeqSettings(Observable):
     def setTrimPrimers(self, newval):
         if self.trim_primers != newval:
             self.trim_primers = newval
-            self.notifyObservers('autotrim_change', ())
-            self.notifySettingsChanged()
+            self.notifySettingsChanged('autotrim_change')
 
     def getPrimerMatchThreshold(self):
         return self.primermatch
@@ -193,8 +232,7 @@ class ConsensSeqSettings(Observable):
 
         if self.primermatch != newval:
             self.primermatch = newval
-            self.notifyObservers('autotrim_change', ())
-            self.notifySettingsChanged()
+            self.notifySettingsChanged('autotrim_change')
 
     def getForwardPrimer(self):
         return self.fwdprimer
@@ -202,8 +240,7 @@ class ConsensSeqSettings(Observable):
     def setForwardPrimer(self, primerseq):
         if self.fwdprimer != primerseq:
             self.fwdprimer = primerseq
-            self.notifyObservers('autotrim_change', ())
-            self.notifySettingsChanged()
+            self.notifySettingsChanged('autotrim_change')
 
     def getReversePrimer(self):
         return self.revprimer
@@ -211,15 +248,14 @@ class ConsensSeqSettings(Observable):
     def setReversePrimer(self, primerseq):
         if self.revprimer != primerseq:
             self.revprimer = primerseq
-            self.notifyObservers('autotrim_change', ())
-            self.notifySettingsChanged()
+            self.notifySettingsChanged('autotrim_change')
 
 
 
 class ConsensSeqBuilderError(Exception):
     pass
 
-class ConsensSeqBuilder:
+class ConsensSeqBuilder(object):
     """
     Constructs a consensus sequence from matching forward and reverse
     sequencing trace data.  After building the consensus sequence, or
@@ -231,6 +267,8 @@ class ConsensSeqBuilder:
 
     # All unambiguous nucleotide codes.
     bases = ('A', 'T', 'G', 'C')
+    # The index of each unambiguous nucleotide in nucleotide probability distributions.
+    base_indexes = {'A': 0, 'T': 1, 'G': 2, 'C': 3}
     # All 2-nucleotide codes, along with the single bases they represent.
     bases2 = {
             'W': ('A', 'T'),
@@ -247,6 +285,19 @@ class ConsensSeqBuilder:
             'V': ('A', 'C', 'G')}
     # All valid nucleotide codes.
     allbases = ('A', 'T', 'G', 'C', 'W', 'S', 'M', 'K', 'R', 'Y', 'B', 'D', 'H', 'V', 'N')
+    # A translation table for trimConsensus() that maps the correctly-called bases,
+    # which are all nucleotide codes except 'N', to chr(1) and all other characters
+    # to chr(0).
+    trim_table = ''.join([chr(1) if chr(code) in allbases and chr(code) != 'N' else chr(0)
+            for code in range(256)])
+    # Lookup tables for the NumPy consensus algorithm.  These are built the first
+    # time they are needed by getBasePrDistArray() and makeBayesianConsensusNumPy().
+    basecode_members = None
+    basecode_counts = None
+    posterior_bases = None
+    posterior_scores = None
+    # The maximum confidence score included in the posterior lookup tables.
+    posterior_maxscore = 61
 
     def __init__(self, sequencetraces, settings=None):
         self.numseqs = len(sequencetraces)
@@ -275,6 +326,11 @@ class ConsensSeqBuilder:
         self.alignedseqs = [None] * self.numseqs
         self.seqindexes = [None] * self.numseqs
 
+        # Set up lists for the per-column arrays of base call codes and confidence
+        # scores for the aligned sequences (see prepareColumnArrays()).
+        self.alignedbases = [None] * self.numseqs
+        self.alignedscores = [None] * self.numseqs
+
         self.makeConsensusSequence()
 
     def getSettings(self):
@@ -288,7 +344,15 @@ class ConsensSeqBuilder:
             raise ConsensSeqBuilderError('The length of the supplied consensus sequence is invalid.')
 
     def makeConsensusSequence(self):
-        min_confscore = self.settings.getMinConfScore()
+        # Read all of the settings up front so they are only looked up once.
+        settings = self.settings
+        min_confscore = settings.getMinConfScore()
+        algorithm = settings.getConsensusAlgorithm()
+        trim_consensus = settings.getTrimConsensus()
+        trim_primers = settings.getTrimPrimers()
+        trim_endgaps = settings.getTrimEndGaps()
+        do_qualitytrim = settings.getDoQualityTrim()
+        winsize, basecnt = settings.getQualityTrimParams()
 
         # Get the raw sequences and align the forward/reverse traces if we have both.
         if self.numseqs == 2:
@@ -302,53 +366,88 @@ class ConsensSeqBuilder:
             self.seqindexes[0] = range(0, len(self.alignedseqs[0]))
 
         # If we have primers, align them to the alignment or single sequence.
-        haveprimers = (self.settings.getForwardPrimer() != '' and self.settings.getReversePrimer() != '')
+        haveprimers = (settings.getForwardPrimer() != '' and settings.getReversePrimer() != '')
         if haveprimers:
             if self.numseqs == 1:
                 self.alignPrimerToSequence()
             else:
                 self.alignPrimersToAlignment()
 
+        # Get the per-column base call and confidence score arrays for the final alignment.
+        self.prepareColumnArrays()
+
         # Build the consensus sequence.
         if self.numseqs == 1:
             self.makeSingleConsensus(min_confscore)
         else:
-            if self.settings.getConsensusAlgorithm() == 'Bayesian':
+            if algorithm == 'Bayesian':
                 self.makeBayesianConsensus(min_confscore)
             else:
                 self.makeLegacyConsensus(min_confscore)
 
         # Do sequence trimming, if requested.
-        if self.settings.getTrimConsensus():
-            if self.settings.getTrimPrimers() and haveprimers:
+        if trim_consensus:
+            if trim_primers and haveprimers:
                 if self.numseqs == 1:
                     self.trimPrimerFromSequence()
                 else:
                     self.trimPrimersFromAlignment()
 
-            if self.settings.getTrimEndGaps():
+            if do_qualitytrim:
+                self.finalizeConsensus(winsize, basecnt, trim_endgaps)
+            elif trim_endgaps:
                 self.trimEndGaps()
 
-            if self.settings.getDoQualityTrim():
-                winsize, basecnt = self.settings.getQualityTrimParams()
-                self.trimConsensus(winsize, basecnt)
+    def prepareColumnArrays(self):
+        """
+        Looks up the confidence score of each base in the aligned sequences, so
+        that the consensus algorithms do not need to query the sequence traces
+        column by column.  The scores for sequence n are saved in
+        self.alignedscores[n], with -1 for each gap position.  If NumPy is
+        available, the scores are saved as an int16 array, and the character
+        codes of the aligned sequence are saved as a uint8 array in
+        self.alignedbases[n].
+        """
+        for seqnum in range(self.numseqs):
+            # Get the scores of all base calls in the alignment with a single call.
+            indexes = self.seqindexes[seqnum]
+            confs = self.seqtraces[seqnum].getBaseCallConfs([index for index in indexes if index >= 0])
+
+            if numpy is not None:
+                self.alignedbases[seqnum] = numpy.frombuffer(self.alignedseqs[seqnum], dtype=numpy.uint8)
+                scores = numpy.empty(len(indexes), dtype=numpy.int16)
+                scores.fill(-1)
+                scores[numpy.array(indexes) >= 0] = confs
+                self.alignedscores[seqnum] = scores
+            else:
+                confs = iter(confs)
+                self.alignedscores[seqnum] = [confs.next() if index >= 0 else -1 for index in indexes]
 
     def makeBayesianConsensus(self, min_confscore):
         """
         Constructs a consensus sequence using Bayesian inference to assign base
         probabilities to each position in the alignment.
         """
+        if numpy is not None:
+            self.makeBayesianConsensusNumPy(min_confscore)
+            return
+
         cons = list()
         consconf = list()
 
-        # Create a dictionary to use for nucleotide posterior probability distributions.
-        nppd = {'A': 0.0, 'T': 0.0, 'G': 0.0, 'C': 0.0}
+        # Create lists to use for nucleotide posterior probability distributions and
+        # the prior distributions they are calculated from.
+        nppd = [0.0] * 4
+        prior = [0.0] * 4
 
         # Get the start indices for the end gap regions of the alignment.
         lgapstart = self.getLeftEndGapStart()
         rgapstart = self.getRightEndGapStart()
 
-        for cnt in range(len(self.alignedseqs[0])):
+        seq1, seq2 = self.alignedseqs
+        scores1, scores2 = self.alignedscores
+
+        for cnt in range(len(seq1)):
             # Initialize variables to indicate no usable data at this position.
             base1 = base2 = 'N'
 
@@ -360,33 +459,33 @@ class ConsensSeqBuilder:
                 #    score2 = mqual
 
 
-            # Get the base calls at this position.
-            base1 = self.alignedseqs[0][cnt]
-            base2 = self.alignedseqs[1][cnt]
+            # Get the base calls at this position and check if they are usable.
+            base1 = seq1[cnt]
+            base2 = seq2[cnt]
+            usable1 = base1 != '-' and base1 != 'N'
+            usable2 = base2 != '-' and base2 != 'N'
 
             # Determine the consensus base at this position.
             gapflankscore = -1.0
-            if base1 not in ('-', 'N') and base2 not in ('-', 'N'):
+            if usable1 and usable2:
                 # Both traces have usable data, so calculate the posterior probability
                 # distribution of nucleotides using Bayes' Theorem, then determine the
                 # consensus base.
-                self.calcPosteriorBasePrDist(
-                        base1, self.seqtraces[0].getBaseCallConf(self.seqindexes[0][cnt]),
-                        base2, self.seqtraces[1].getBaseCallConf(self.seqindexes[1][cnt]), nppd)
+                self.calcPosteriorBasePrDist(base1, scores1[cnt], base2, scores2[cnt], nppd, prior)
                 cbase, cscore = self.getMostProbableBase(nppd)
-            elif base1 not in ('-', 'N'):
+            elif usable1:
                 # Only the first trace has usable data.
                 cbase = base1
-                cscore = self.seqtraces[0].getBaseCallConf(self.seqindexes[0][cnt])
+                cscore = scores1[cnt]
 
                 # Check if this is an internal gap.
                 if cnt >= lgapstart and cnt <= rgapstart and base2 == '-':
                     # It is, so get the mean score of the flanking bases.
                     gapflankscore = self.getGapFlankingScore(1, cnt)
-            elif base2 not in ('-', 'N'):
+            elif usable2:
                 # Only the second trace has usable data.
                 cbase = base2
-                cscore = self.seqtraces[1].getBaseCallConf(self.seqindexes[1][cnt])
+                cscore = scores2[cnt]
 
                 # Check if this is an internal gap.
                 if cnt >= lgapstart and cnt <= rgapstart and base1 == '-':
@@ -415,6 +514,187 @@ class ConsensSeqBuilder:
         self.consensus = ''.join(cons)
         self.consconf = consconf
 
+    def makeBayesianConsensusNumPy(self, min_confscore):
+        """
+        Implements makeBayesianConsensus() with NumPy.  Rather than looping over
+        the alignment columns, the posterior nucleotide probability distributions
+        for all columns are calculated at once.  If the compiled column loop from
+        seqtrace.core.bayes is available, it is used instead.  The results are the
+        same as for the native Python algorithm.
+        """
+        seq1, seq2 = self.alignedbases
+        scores1, scores2 = self.alignedscores
+        numcols = len(seq1)
+
+        # For columns where only one trace has usable data and the other trace
+        # has an internal gap, get the mean score of the bases flanking the gap.
+        gapflankscores = self.getGapFlankingScoreArray(seq1, seq2)
+
+        # If a compiled implementation of the column loop is available, use it.
+        if bayesianConsensus is not None:
+            cons, consconf = bayesianConsensus(seq1, scores1, seq2, scores2, gapflankscores, min_confscore)
+            self.consensus = cons.tobytes()
+            self.consconf = consconf.tolist()
+            return
+
+        # Find the columns with usable data in each trace.
+        usable1 = usable_codes[seq1]
+        usable2 = usable_codes[seq2]
+
+        # Initialize all columns to indicate no usable data.
+        cons = numpy.empty(numcols, dtype=numpy.uint8)
+        cons.fill(ord('N'))
+        consconf = numpy.ones(numcols, dtype=numpy.float64)
+
+        # Columns where both traces have usable data.  The results for unambiguous
+        # base calls with typical confidence scores are looked up; for all other
+        # columns, the most probable bases are calculated.
+        both = usable1 & usable2
+        if both.any():
+            if ConsensSeqBuilder.posterior_bases is None:
+                self.buildPosteriorTables()
+
+            codes1 = base_codes[seq1]
+            codes2 = base_codes[seq2]
+            maxscore = self.posterior_maxscore
+            inlut = (both & (codes1 >= 0) & (codes2 >= 0) & (scores1 >= 0) & (scores1 <= maxscore)
+                    & (scores2 >= 0) & (scores2 <= maxscore))
+            if inlut.any():
+                lutindexes = (codes1[inlut], codes2[inlut], scores1[inlut], scores2[inlut])
+                cons[inlut] = self.posterior_bases[lutindexes]
+                consconf[inlut] = self.posterior_scores[lutindexes]
+
+            calc = both & ~inlut
+            if calc.any():
+                cons[calc], consconf[calc] = self.getMostProbableBasesArray(
+                        seq1[calc], scores1[calc], seq2[calc], scores2[calc])
+
+        # Columns where only one trace has usable data.
+        useonly = usable1 & ~usable2
+        cons[useonly] = seq1[useonly]
+        consconf[useonly] = scores1[useonly]
+        useonly = usable2 & ~usable1
+        cons[useonly] = seq2[useonly]
+        consconf[useonly] = scores2[useonly]
+
+        # Columns with a gap in both sequences due to the primer alignment.
+        bothgaps = (seq1 == ord('-')) & (seq2 == ord('-'))
+        cons[bothgaps] = ord(' ')
+        consconf[bothgaps] = 0
+
+        # Replace low-quality bases with 'N', unless they are next to a spurious
+        # gap, in which case they are deleted from the consensus sequence.
+        lowqual = (consconf < min_confscore) & (cons != ord(' '))
+        cons[lowqual] = numpy.where(gapflankscores[lowqual] > min_confscore, ord(' '), ord('N'))
+
+        self.consensus = cons.tobytes()
+        self.consconf = consconf.tolist()
+
+    def getMostProbableBasesArray(self, basecalls1, scores1, basecalls2, scores2):
+        """
+        A vectorized version of calcPosteriorBasePrDist() followed by
+        getMostProbableBase().  Given the base call character codes and
+        confidence scores of two aligned sequences, returns an array with the
+        character codes of the most probable bases and an array with their
+        Phred-type quality scores.
+        """
+        # Calculate the posterior probability distribution of nucleotides for
+        # every column using Bayes' Theorem, then find the most probable bases.
+        prior = self.getBasePrDistArray(basecalls1, scores1)
+        joint = self.getBasePrDistArray(basecalls2, scores2) * prior
+        joint /= joint[0] + joint[1] + joint[2] + joint[3]
+        maxindexes = joint.argmax(axis=0)
+        maxprobs = joint[maxindexes, numpy.arange(len(maxindexes))]
+
+        # Calculate the Phred-type quality scores, adding a very small quantity to
+        # avoid rounding errors (see getMostProbableBase()).
+        with numpy.errstate(divide='ignore'):
+            bscores = numpy.where(maxprobs > 0, -10.0 * numpy.log10(1.0 - maxprobs), 0.0)
+
+        return (numpy.frombuffer('ATGC', dtype=numpy.uint8)[maxindexes], bscores + 0.000001)
+
+    def buildPosteriorTables(self):
+        """
+        Builds the lookup tables used by makeBayesianConsensusNumPy() for columns
+        where both base calls are unambiguous and both confidence scores are
+        between 0 and posterior_maxscore.  The tables are indexed by the base
+        indexes (in the order 'A', 'T', 'G', 'C') and the scores of the two base
+        calls, and give the character code and score of the most probable base.
+        """
+        numscores = self.posterior_maxscore + 1
+        shape = (4, 4, numscores, numscores)
+        codes1, codes2, scores1, scores2 = numpy.indices(shape).reshape(4, -1)
+        basecodes = numpy.frombuffer('ATGC', dtype=numpy.uint8)
+
+        cbases, cscores = self.getMostProbableBasesArray(
+                basecodes[codes1], scores1, basecodes[codes2], scores2)
+
+        ConsensSeqBuilder.posterior_scores = cscores.reshape(shape)
+        ConsensSeqBuilder.posterior_bases = cbases.reshape(shape)
+
+    def getBasePrDistArray(self, basecalls, scores):
+        """
+        A vectorized version of defineBasePrDist().  Given an array of base call
+        character codes and an array of matching confidence scores, returns a
+        4 x n array of nucleotide probabilities with rows in the order 'A', 'T',
+        'G', 'C'.  Fully supports all IUPAC ambiguity codes.
+        """
+        # Build the lookup tables the first time they are needed.  For each
+        # character code, basecode_members marks the bases that the code
+        # represents and basecode_counts gives the number of bases represented.
+        if ConsensSeqBuilder.basecode_members is None:
+            members = numpy.zeros((4, 256), dtype=bool)
+            for code, codebases in ([(base, (base,)) for base in self.bases]
+                    + self.bases2.items() + self.bases3.items()):
+                for base in codebases:
+                    members[self.bases.index(base), ord(code)] = True
+            ConsensSeqBuilder.basecode_counts = members.sum(axis=0)
+            ConsensSeqBuilder.basecode_members = members
+
+        # Look up the error probabilities if the scores are all integers in the
+        # table; otherwise, calculate them.
+        if scores.dtype.kind in 'iu' and (len(scores) == 0
+                or (scores.min() >= -128 and scores.max() <= 255)):
+            eprobs = error_probs_array[scores + 128]
+        else:
+            eprobs = 10.0 ** (scores / -10.0)
+
+        # As in defineBasePrDist(), the probability of a correct call is split among
+        # the bases represented by the call, and the error probability is split
+        # among the remaining bases.
+        counts = self.basecode_counts[basecalls]
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            dist = numpy.where(self.basecode_members[:, basecalls],
+                    (1 - eprobs) / counts, eprobs / (4 - counts))
+
+        return dist
+
+    def getGapFlankingScoreArray(self, seq1, seq2):
+        """
+        Given the character codes of the two aligned sequences as uint8 arrays,
+        returns an array with the result of getGapFlankingScore() for each column
+        where only one trace has usable data and the other trace has an internal
+        gap.  All other columns get -1.  This is the gapflankscores argument of
+        the compiled bayesianConsensus() implementations.
+        """
+        numcols = len(seq1)
+
+        # Find the columns with usable data in each trace.
+        usable1 = usable_codes[seq1]
+        usable2 = usable_codes[seq2]
+
+        # Find the columns that are between the end gap regions of the alignment.
+        internal = numpy.zeros(numcols, dtype=bool)
+        internal[max(self.getLeftEndGapStart(), 0):self.getRightEndGapStart() + 1] = True
+
+        gapflankscores = numpy.empty(numcols, dtype=numpy.float64)
+        gapflankscores.fill(-1.0)
+        for seqnum, useonly, otherseq in ((0, usable1 & ~usable2, seq2), (1, usable2 & ~usable1, seq1)):
+            for cnt in numpy.flatnonzero(useonly & internal & (otherseq == ord('-'))):
+                gapflankscores[cnt] = self.getGapFlankingScore((seqnum + 1) % 2, cnt)
+
+        return gapflankscores
+
     def getGapFlankingScore(self, seqnum, pos):
         """
         Returns the log-adjusted mean score of the two bases flanking an
@@ -434,16 +714,19 @@ class ConsensSeqBuilder:
         """
         This function determines the most probable base and calculates its associated
         Phred-type quality score from a nucleotide posterior probability distribution.
+        The distribution nppd is expected to be a 4-element list with the probabilities
+        for 'A', 'T', 'G', and 'C', in that order.
         """
         # Find the base with the highest probability.
-        cbase = 'A'
-        for base in ('T', 'G', 'C'):
-            if nppd[base] > nppd[cbase]:
-                cbase = base
+        maxindex = 0
+        for index in (1, 2, 3):
+            if nppd[index] > nppd[maxindex]:
+                maxindex = index
+        cbase = self.bases[maxindex]
 
         # Calculate the Phred-type quality score of the most probable base.
-        if nppd[cbase] > 0:
-            cscore = -10.0 * math.log10(1.0 - nppd[cbase])
+        if nppd[maxindex] > 0:
+            cscore = -10.0 * math.log10(1.0 - nppd[maxindex])
         else:
             cscore = 0
 
@@ -459,66 +742,64 @@ class ConsensSeqBuilder:
 
         return (cbase, cscore)
 
-    def defineBasePrDist(self, basecall, score, distdict):
+    def defineBasePrDist(self, basecall, score, dist):
         """
         Defines a nucleotide probability distribution based on a given base call
         and Phred-type quality score.  Fully supports all IUPAC ambiguity codes.
-        The argument "distdict" is expected to be a dictionary with elements
-        indexed by 'A', 'T', 'G', and 'C'.
+        The argument "dist" is expected to be a 4-element list, which is filled
+        with the probabilities for 'A', 'T', 'G', and 'C', in that order.
         """
-        # Calculate the error probability.
-        eprob = 10.0 ** (score / -10.0)
+        # Look up the error probability, or calculate it if the score is not in
+        # the table.
+        eprob = error_probs.get(score)
+        if eprob is None:
+            eprob = 10.0 ** (score / -10.0)
 
         # Determine if we have a single base or an ambiguity code and handle
         # each situation appropriately.
         if basecall in self.bases:
             # Fill in the probabilities for each base.
-            distdict[basecall] = 1 - eprob
-            for base in self.bases:
-                if base != basecall:
-                    distdict[base] = eprob / 3.0
+            dist[0] = dist[1] = dist[2] = dist[3] = eprob / 3.0
+            dist[self.base_indexes[basecall]] = 1 - eprob
         elif basecall in self.bases2:
             # We have a 2-base ambiguity code, so split the probability of
             # a correct call between the two bases represented.
             # First assign the error probability to all bases.
-            for base in self.bases:
-                distdict[base] = eprob / 2.0
+            dist[0] = dist[1] = dist[2] = dist[3] = eprob / 2.0
             # Then assign the correct call probabilities.
             for base in self.bases2[basecall]:
-                distdict[base] = (1 - eprob) / 2.0
+                dist[self.base_indexes[base]] = (1 - eprob) / 2.0
         elif basecall in self.bases3:
             # We have a 3-base ambiguity code, so split the probability of
             # a correct call between the three bases represented.
             # First assign the error probability to all bases.
-            for base in self.bases:
-                distdict[base] = eprob
+            dist[0] = dist[1] = dist[2] = dist[3] = eprob
             # Then assign the correct call probabilities.
             for base in self.bases3[basecall]:
-                distdict[base] = (1 - eprob) / 3.0
+                dist[self.base_indexes[base]] = (1 - eprob) / 3.0
 
-    def calcPosteriorBasePrDist(self, base1, score1, base2, score2, distdict):
+    def calcPosteriorBasePrDist(self, base1, score1, base2, score2, nppd, prior):
         """
         Uses Bayes' theorem to calculate a posterior distribution of nucleotide
         probabilities with the provided base calls and confidence scores.  The
-        result is returned in the argument "distdict", which is expected to be a
-        dictionary with elements indexed by 'A', 'T', 'G', and 'C'.
+        result is returned in the argument "nppd", which is expected to be a
+        4-element list; see defineBasePrDist().  The argument "prior" must also
+        be a 4-element list, which is used as working space for the prior
+        distribution so that callers can reuse it for many calculations.
         """
         # Get the prior distribution using the 1st base call and quality score.
-        prior = {'A': 0.0, 'T': 0.0, 'G': 0.0, 'C': 0.0}
         self.defineBasePrDist(base1, score1, prior)
 
-        # Use distdict to hold the conditional probabilities for the 2nd base call.
-        self.defineBasePrDist(base2, score2, distdict)
+        # Use nppd to hold the conditional probabilities for the 2nd base call.
+        self.defineBasePrDist(base2, score2, nppd)
 
         # Calculate the shared denominator for Bayes' theorem, which is the total
         # probability of observing the 2nd base call.
-        denom = 0.0
-        for base in self.bases:
-            denom += distdict[base] * prior[base]
+        denom = nppd[0] * prior[0] + nppd[1] * prior[1] + nppd[2] * prior[2] + nppd[3] * prior[3]
 
         # Calculate the posterior probability distribution.
-        for base in self.bases:
-            distdict[base] = (distdict[base] * prior[base]) / denom
+        for index in (0, 1, 2, 3):
+            nppd[index] = (nppd[index] * prior[index]) / denom
 
     def makeLegacyConsensus(self, min_confscore):
         """
@@ -528,20 +809,29 @@ class ConsensSeqBuilder:
         score information as effectively as the Bayesian approach, so the latter
         should generally be used instead.
         """
+        if numpy is not None:
+            self.makeLegacyConsensusNumPy(min_confscore)
+            return
+
         cons = list()
         consconf = list()
         #print self.alignedseqs[1]
         #print self.seqindexes[1]
         #print len(self.seqtraces[1].getBaseCalls())
 
-        for cnt in range(len(self.alignedseqs[0])):
+        seq1, seq2 = self.alignedseqs
+        scores1, scores2 = self.alignedscores
+
+        for cnt in range(len(seq1)):
+            base1 = seq1[cnt]
+            base2 = seq2[cnt]
             cscore = cscore2 = -1
-            if (self.alignedseqs[0][cnt] != '-') and (self.alignedseqs[0][cnt] != 'N'):
-                cbase = self.alignedseqs[0][cnt]
-                cscore = self.seqtraces[0].getBaseCallConf(self.seqindexes[0][cnt])
-            if (self.alignedseqs[1][cnt] != '-') and (self.alignedseqs[1][cnt] != 'N'):
-                cbase2 = self.alignedseqs[1][cnt]
-                cscore2 = self.seqtraces[1].getBaseCallConf(self.seqindexes[1][cnt])
+            if (base1 != '-') and (base1 != 'N'):
+                cbase = base1
+                cscore = scores1[cnt]
+            if (base2 != '-') and (base2 != 'N'):
+                cbase2 = base2
+                cscore2 = scores2[cnt]
 
             if cscore >= min_confscore:
                 if cscore2 >= min_confscore:
@@ -550,7 +840,7 @@ class ConsensSeqBuilder:
             elif cscore2 >= min_confscore:
                 cscore = cscore2
                 cbase = cbase2
-            elif self.alignedseqs[0][cnt] == '-' and self.alignedseqs[1][cnt] == '-':
+            elif base1 == '-' and base2 == '-':
                 # We encountered a gap in both sequences due to the primer alignment.
                 cscore = cscore2 = 0
                 cbase = ' '
@@ -573,14 +863,21 @@ class ConsensSeqBuilder:
         call to see if it exceeds the minimum quality threshold.  If ambiguous bases
         meet the quality criterion, they are retained in the final sequence.
         """
+        if numpy is not None:
+            self.makeSingleConsensusNumPy(min_confscore)
+            return
+
         cons = list()
         consconf = list()
 
-        for cnt in range(len(self.alignedseqs[0])):
+        seq = self.alignedseqs[0]
+        scores = self.alignedscores[0]
+
+        for cnt in range(len(seq)):
             cscore = 0
-            cbase = self.alignedseqs[0][cnt]
+            cbase = seq[cnt]
             if cbase != '-':
-                cscore = self.seqtraces[0].getBaseCallConf(self.seqindexes[0][cnt])
+                cscore = scores[cnt]
 
                 if cscore < min_confscore:
                     cbase = 'N'
@@ -595,6 +892,57 @@ class ConsensSeqBuilder:
         self.consensus = ''.join(cons)
         self.consconf = consconf
 
+    def makeLegacyConsensusNumPy(self, min_confscore):
+        """
+        Implements makeLegacyConsensus() with NumPy by processing all alignment
+        columns at once.
+        """
+        seq1, seq2 = self.alignedbases
+
+        # Get the scores of the usable base calls; all other columns get -1.
+        scores1 = numpy.where(usable_codes[seq1], self.alignedscores[0], -1)
+        scores2 = numpy.where(usable_codes[seq2], self.alignedscores[1], -1)
+        good1 = scores1 >= min_confscore
+        good2 = scores2 >= min_confscore
+
+        # Use a good base call from the first trace, unless the second trace has
+        # a good, conflicting call.  Otherwise, use a good call from the second
+        # trace.  Everything else is 'N'.
+        cons = numpy.empty(len(seq1), dtype=numpy.uint8)
+        cons.fill(ord('N'))
+        cons[good1] = seq1[good1]
+        cons[good1 & good2 & (seq1 != seq2)] = ord('N')
+        only2 = good2 & ~good1
+        cons[only2] = seq2[only2]
+        consconf = numpy.maximum(scores1, scores2)
+
+        # Columns with a gap in both sequences due to the primer alignment.
+        bothgaps = (seq1 == ord('-')) & (seq2 == ord('-'))
+        cons[bothgaps] = ord(' ')
+        consconf[bothgaps] = 0
+
+        self.consensus = cons.tobytes()
+        self.consconf = consconf.tolist()
+
+    def makeSingleConsensusNumPy(self, min_confscore):
+        """
+        Implements makeSingleConsensus() with NumPy by processing all alignment
+        columns at once.
+        """
+        seq = self.alignedbases[0]
+        consconf = self.alignedscores[0].copy()
+
+        # Low-quality bases become 'N', and gaps due to the primer alignment
+        # become spaces.
+        gaps = seq == ord('-')
+        cons = seq.copy()
+        cons[~gaps & (consconf < min_confscore)] = ord('N')
+        cons[gaps] = ord(' ')
+        consconf[gaps] = 0
+
+        self.consensus = cons.tobytes()
+        self.consconf = consconf.tolist()
+
     def getLeftEndGapStart(self):
         """
         Returns the index of the start of the left end gap.  If there are overlapping
@@ -605,25 +953,16 @@ class ConsensSeqBuilder:
         if self.numseqs == 1:
             return -1
 
-        lgindex = 0
-
-        # Move past any end positions where both trace sequences are gaps.
-        # This can happen when primers are aligned to the ends.
-        while lgindex < len(self.alignedseqs[0]) and self.alignedseqs[0][lgindex] == '-' and self.alignedseqs[1][lgindex] == '-':
-            lgindex += 1
-
-        # Check if both sequences were empty.
-        if lgindex == len(self.alignedseqs[0]):
-            return -1
-
-        if self.alignedseqs[0][lgindex] == '-':
-            while (lgindex < len(self.alignedseqs[0])) and (self.alignedseqs[0][lgindex] == '-'):
-                lgindex += 1
-        elif self.alignedseqs[1][lgindex] == '-':
-            while (lgindex < len(self.alignedseqs[0])) and (self.alignedseqs[1][lgindex] == '-'):
-                lgindex += 1
+        # The left end gap ends at the first base of whichever sequence has the
+        # longer run of leading gaps.  Any leading positions where both sequences
+        # are gaps (which can happen when primers are aligned to the ends) are
+        # skipped automatically.  str.lstrip() does the scanning in C.
+        seqlen = len(self.alignedseqs[0])
+        lgindex = max(seqlen - len(self.alignedseqs[0].lstrip('-')),
+                seqlen - len(self.alignedseqs[1].lstrip('-')))
 
-        if lgindex == len(self.alignedseqs[0]):
+        # Check if either sequence was empty.
+        if lgindex == seqlen:
             return -1
         else:
             return lgindex
@@ -638,25 +977,10 @@ class ConsensSeqBuilder:
         if self.numseqs == 1:
             return -1
 
-        rgindex = len(self.alignedseqs[0]) - 1
-
-        # Move past any end positions where both trace sequences are gaps.
-        # This can happen when primers are aligned to the ends.
-        while rgindex >= 0 and self.alignedseqs[0][rgindex] == '-' and self.alignedseqs[1][rgindex] == '-':
-            rgindex -= 1
-
-        # Check if both sequences were empty.
-        if rgindex < 0:
-            return rgindex
-
-        if self.alignedseqs[0][rgindex] == '-':
-            while (rgindex >= 0) and (self.alignedseqs[0][rgindex] == '-'):
-                rgindex -= 1
-        elif self.alignedseqs[1][rgindex] == '-':
-            while (rgindex >= 0) and (self.alignedseqs[1][rgindex] == '-'):
-                rgindex -= 1
-
-        return rgindex
+        # The right end gap starts after the last base of whichever sequence has
+        # the longer run of trailing gaps.  If either sequence is empty, this
+        # is -1.
+        return min(len(self.alignedseqs[0].rstrip('-')), len(self.alignedseqs[1].rstrip('-'))) - 1
 
     def alignPrimersToAlignment(self):
         """
@@ -958,30 +1282,53 @@ class ConsensSeqBuilder:
         self.consensus = ((' ' * lgindex) + self.consensus[lgindex:rgindex + 1]
                 + (' ' * (len(self.consensus) - rgindex - 1)))
 
+    def finalizeConsensus(self, winsize, basecnt, trim_endgaps):
+        """
+        Does the final trimming of the consensus sequence.  This gives the same
+        result as calling trimEndGaps() (if trim_endgaps is True) followed by
+        trimConsensus(), but if NumPy is available, the end gaps and the quality
+        windows are located first and the trimmed consensus sequence is only
+        built once.
+        """
+        if numpy is None:
+            if trim_endgaps:
+                self.trimEndGaps()
+            self.trimConsensus(winsize, basecnt)
+            return
+
+        startindex = 0
+        endindex = len(self.consensus) - 1
+
+        if trim_endgaps and self.numseqs == 2:
+            startindex = self.getLeftEndGapStart()
+            endindex = self.getRightEndGapStart()
+
+            # Handle an empty sequence the same way as trimEndGaps().
+            if endindex == -1:
+                startindex = 0
+
+        self.trimConsensusNumPy(winsize, basecnt, startindex, endindex)
+
     def trimConsensus(self, winsize, basecnt):
         """
         Trims the ends of the consensus sequence until basecnt bases within a
         run of winsize bases meet the minimum quality threshold.  Any spaces in
         the sequence are ignored and not counted in the window size.
         """
-        # Build a dictionary for all valid nucleotide codes that will be
-        # used for counting the number of good bases in a window.
-        base_to_int = {}
-        for base in self.allbases:
-            base_to_int[base] = 1
-        base_to_int['N'] = 0
+        if numpy is not None:
+            self.trimConsensusNumPy(winsize, basecnt)
+            return
 
-        # First, eliminate spaces from the consensus sequence.
-        compcons = self.consensus.replace(' ', '')
+        # Eliminate spaces from the consensus sequence and map it to simple integer values in a
+        # single pass.  Correctly-called bases get assigned a 1, incorrectly-called bases get
+        # assigned a 0.  Indexing the bytearray gives the integer values directly.
+        consensus = self.consensus
+        consvals = bytearray(consensus.translate(self.trim_table, ' '))
 
         # Make sure there are enough bases to actually do the analysis.
-        if len(compcons) < winsize:
+        if len(consvals) < winsize:
             return
 
-        # Build a list mapping the consensus sequence to simple integer values.  Correctly-called
-        # bases get assigned a 1, incorrectly-called bases get assigned a 0.
-        consvals = [base_to_int[base] for base in compcons]
-
         # Analyze the left end (5') of the sequence first.
         index = 0
 
@@ -989,7 +1336,7 @@ class ConsensSeqBuilder:
         num_good = sum(consvals[0:winsize])
 
         # Slide the window along the sequence until it contains enough correct base calls.
-        while (num_good < basecnt) and ((index + winsize) < len(compcons)):
+        while (num_good < basecnt) and ((index + winsize) < len(consvals)):
             num_good += consvals[index + winsize]
             num_good -= consvals[index]
 
@@ -1000,13 +1347,13 @@ class ConsensSeqBuilder:
         index_left = skipcnt = -1
         while skipcnt != index:
             index_left += 1
-            if self.consensus[index_left] != ' ':
+            if consensus[index_left] != ' ':
                 skipcnt += 1
         #print 'index_left:', index_left, 'num_good:', num_good
 
         # Now analyze the right end (3') of the sequence.
         indexold = index
-        index = len(compcons) - 1
+        index = len(consvals) - 1
 
         # Initialize the count of good bases.
         num_good = sum(consvals[len(consvals) - winsize:len(consvals)])
@@ -1023,7 +1370,7 @@ class ConsensSeqBuilder:
         index_right = skipcnt = -1
         while skipcnt != index:
             index_right += 1
-            if self.consensus[index_right] != ' ':
+            if consensus[index_right] != ' ':
                 skipcnt += 1
         #print 'index:', index
         #print 'index_right:', index_right, 'num_good:', num_good
@@ -1031,14 +1378,83 @@ class ConsensSeqBuilder:
         if num_good < basecnt:
             # If we failed to find a sufficient number of quality bases anywhere in the sequence,
             # simply trim the entire string.
-            new_consensus = ' ' * len(self.consensus)
+            new_consensus = ' ' * len(consensus)
         else:
             # Build the trimmed consensus sequence.
-            new_consensus = ((' ' * index_left) + self.consensus[index_left:index_right + 1]
-                    + (' ' * (len(self.consensus) - index_right - 1)))
+            new_consensus = ((' ' * index_left) + consensus[index_left:index_right + 1]
+                    + (' ' * (len(consensus) - index_right - 1)))
 
         self.consensus = new_consensus
 
+    def trimConsensusNumPy(self, winsize, basecnt, startindex=0, endindex=None):
+        """
+        Implements trimConsensus() with NumPy.  Instead of sliding the window one
+        base at a time, the number of good bases in every window is calculated at
+        once from the cumulative sum of good bases.  If startindex and endindex
+        are given, only that part of the consensus sequence is analyzed, and
+        everything outside of it is trimmed, too (see finalizeConsensus()).
+        """
+        consensus = self.consensus
+        if endindex is None:
+            endindex = len(consensus) - 1
+
+        cons = numpy.frombuffer(consensus, dtype=numpy.uint8)
+
+        # Get the locations of the non-space characters in the region to analyze.
+        nonspace = numpy.flatnonzero(cons[startindex:endindex + 1] != ord(' ')) + startindex
+
+        # Make sure there are enough bases to actually do the analysis.  If not,
+        # only the parts outside of the region are trimmed.
+        if len(nonspace) < winsize:
+            if startindex == 0 and endindex == len(consensus) - 1:
+                return
+            index_left, index_right = startindex, endindex
+        else:
+            # Mark the correctly-called bases, which are all nucleotide codes except 'N'.
+            goodcodes = numpy.frombuffer(''.join(self.allbases).replace('N', ''), dtype=numpy.uint8)
+            good = numpy.in1d(cons[nonspace], goodcodes)
+
+            # Find the first and last windows that contain enough correct base calls.
+            # If the compiled window scan is available, use it.
+            if findTrimWindows is not None:
+                firstwin, lastwin = findTrimWindows(good.view(numpy.uint8), winsize, basecnt)
+            else:
+                firstwin, lastwin = self.findTrimWindowsNumPy(good, winsize, basecnt)
+
+            if firstwin == -1:
+                # If we failed to find a sufficient number of quality bases anywhere in the sequence,
+                # simply trim the entire string.
+                self.consensus = ' ' * len(consensus)
+                return
+
+            # Find the indexes in the consensus after accounting for any ignored spaces.
+            index_left = int(nonspace[firstwin])
+            index_right = int(nonspace[lastwin + winsize - 1])
+
+        # Build the trimmed consensus sequence.
+        self.consensus = ((' ' * index_left) + consensus[index_left:index_right + 1]
+                + (' ' * (len(consensus) - index_right - 1)))
+
+    def findTrimWindowsNumPy(self, good, winsize, basecnt):
+        """
+        A NumPy version of the window scan in seqtrace.core.bayes.findTrimWindows().
+        The boolean array good marks the correctly-called bases of the consensus
+        sequence with all spaces removed.  Returns the start indexes of the first
+        and last windows of winsize bases that contain at least basecnt good bases,
+        or (-1, -1) if there are no such windows.  Rather than sliding a window along
+        the sequence, the good bases in every window are counted at once from the
+        cumulative sum of good bases.
+        """
+        goodsums = numpy.zeros(len(good) + 1, dtype=numpy.int64)
+        numpy.cumsum(good, out=goodsums[1:])
+        wingood = goodsums[winsize:] - goodsums[:len(goodsums) - winsize]
+        hits = numpy.flatnonzero(wingood >= basecnt)
+
+        if len(hits) == 0:
+            return (-1, -1)
+
+        return (int(hits[0]), int(hits[-1]))
+
     def getNumSeqs(self):
         return self.numseqs
 
@@ -1084,6 +1500,60 @@ class ModifiableConsensSeqBuilder(ConsensSeqBuilder, Observable):
         # initialize observable events
         self.defineObservableEvents(['consensus_changed', 'undo_state_changed', 'redo_state_changed'])
 
+    # The consensus sequence is stored in a bytearray so that user edits, undo, and
+    # redo can modify it in place rather than rebuilding the entire string.  The
+    # consensus property keeps the "consensus" attribute used by ConsensSeqBuilder
+    # working with the buffer.  The string form of the buffer is only built when
+    # it is needed, and it is kept in consensus_str until the buffer is modified.
+    def getConsensusStr(self):
+        if self.consensus_str is None:
+            self.consensus_str = str(self.consensus_buf)
+
+        return self.consensus_str
+
+    def setConsensusStr(self, newcons):
+        self.consensus_buf = bytearray(newcons.encode('ascii'))
+        self.consensus_str = str(newcons)
+
+    consensus = property(getConsensusStr, setConsensusStr)
+
+    def makeConsensusSequence(self):
+        ConsensSeqBuilder.makeConsensusSequence(self)
+
+        # Remember the inputs that produced the new consensus sequence.
+        self.cons_fingerprint = self.getConsensusFingerprint()
+
+    def getConsensusFingerprint(self):
+        """
+        Returns a tuple of all of the settings and sequence traces that determine
+        the result of makeConsensusSequence().
+        """
+        settings = self.settings
+        fingerprint = [settings.getMinConfScore(), settings.getConsensusAlgorithm(),
+                settings.getTrimConsensus(), settings.getTrimEndGaps(), settings.getTrimPrimers(),
+                settings.getPrimerMatchThreshold(), settings.getForwardPrimer(),
+                settings.getReversePrimer(), settings.getDoQualityTrim(), settings.getQualityTrimParams()]
+        for seqt in self.seqtraces:
+            fingerprint.append((id(seqt), seqt.isReverseComplemented()))
+
+        return tuple(fingerprint)
+
+    def setConsensSequence(self, use_consens_seq):
+        ConsensSeqBuilder.setConsensSequence(self, use_consens_seq)
+        self.cons_fingerprint = None
+
+    def getConsensus(self, startindex=0, endindex=-1):
+        if startindex == 0 and endindex == -1:
+            return self.getConsensusStr()
+
+        if endindex == -1:
+            endindex = len(self.consensus_buf) - 1
+
+        return str(self.consensus_buf[startindex:endindex+1])
+
+    def getCompactConsensus(self):
+        return str(self.consensus_buf.replace(' ', ''))
+
     def deleteBases(self, start_index, end_index):
         # swap the start and end points, if necessary
         if start_index > end_index:
@@ -1092,10 +1562,12 @@ class ModifiableConsensSeqBuilder(ConsensSeqBuilder, Observable):
             end_index = tmp
 
         # add the undo information
-        self.undo_stack.append({'start': start_index, 'end': end_index, 'data': self.consensus[start_index:end_index+1]})
+        self.undo_stack.append({'start': start_index, 'end': end_index, 'data': bytes(self.consensus_buf[start_index:end_index+1])})
 
         # delete the bases
-        self.consensus = self.consensus[0:start_index] + ' '*(end_index-start_index+1) + self.consensus[end_index+1:]
+        self.consensus_buf[start_index:end_index+1] = ' '*(end_index-start_index+1)
+        self.consensus_str = None
+        self.cons_fingerprint = None
 
         self.notifyObservers('consensus_changed', (start_index, end_index))
         if len(self.undo_stack) == 1:
@@ -1123,16 +1595,23 @@ class ModifiableConsensSeqBuilder(ConsensSeqBuilder, Observable):
             raise ConsensSeqBuilderError('The replacement sequence contains invalid characters.')
 
         # add the undo information
-        self.undo_stack.append({'start': start_index, 'end': end_index, 'data': self.consensus[start_index:end_index+1]})
+        self.undo_stack.append({'start': start_index, 'end': end_index, 'data': bytes(self.consensus_buf[start_index:end_index+1])})
 
         # insert the new bases
-        self.consensus = self.consensus[0:start_index] + newseq + self.consensus[end_index+1:]
+        self.consensus_buf[start_index:end_index+1] = newseq.encode('ascii')
+        self.consensus_str = None
+        self.cons_fingerprint = None
 
         self.notifyObservers('consensus_changed', (start_index, end_index))
         if len(self.undo_stack) == 1:
             self.notifyObservers('undo_state_changed', (True,))
 
     def recalcConsensusSequence(self):
+        # If the consensus sequence has not been edited since it was calculated, and
+        # none of its inputs have changed, there is nothing to do.
+        if self.cons_fingerprint is not None and self.cons_fingerprint == self.getConsensusFingerprint():
+            return
+
         oldcons = self.consensus
         self.makeConsensusSequence()
 
@@ -1152,9 +1631,11 @@ class ModifiableConsensSeqBuilder(ConsensSeqBuilder, Observable):
             end = u['end']
 
             # save the redo information
-            self.redo_stack.append({'start': start, 'end': end, 'data': self.consensus[start:end+1]})
+            self.redo_stack.append({'start': start, 'end': end, 'data': bytes(self.consensus_buf[start:end+1])})
 
-            self.consensus = self.consensus[0:start] + u['data'] + self.consensus[end+1:]
+            self.consensus_buf[start:end+1] = u['data']
+            self.consensus_str = None
+            self.cons_fingerprint = None
 
             self.notifyObservers('consensus_changed', (start, end))
             if len(self.redo_stack) == 1:
@@ -1169,9 +1650,11 @@ class ModifiableConsensSeqBuilder(ConsensSeqBuilder, Observable):
             end = r['end']
 
             # save the undo information
-            self.undo_stack.append({'start': start, 'end': end, 'data': self.consensus[start:end+1]})
+            self.undo_stack.append({'start': start, 'end': end, 'data': bytes(self.consensus_buf[start:end+1])})
 
-            self.consensus = self.consensus[0:start] + r['data'] + self.consensus[end+1:]
+            self.consensus_buf[start:end+1] = r['data']
+            self.consensus_str = None
+            self.cons_fingerprint = None
 
             self.notifyObservers('consensus_changed', (start, end))
             if len(self.undo_stack) == 1:
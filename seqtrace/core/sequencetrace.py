@@ -186,6 +186,14 @@ class SequenceTrace:
     def getBaseCallConf(self, index):
         return self.bcconf[index]
 
+    def getBaseCallConfs(self, indexes):
+        """
+        Returns a list of the confidence scores of the base calls at each of the
+        locations in indexes.
+        """
+        bcconf = self.bcconf
+        return [bcconf[index] for index in indexes]
+
     # If sampnum < the first base call location, returns the first base call location.
     def getPrevBaseCallIndex(self, sampnum):
         # do a binary search for the index of the base call located at,
@@ -16,7 +16,20 @@
 
 
 from seqtrace.core.consens import *
+import seqtrace.core.consens as consens
 from seqtrace.core.sequencetrace import SequenceTrace
+try:
+    # try to load the Numba implementation of the Bayesian consensus algorithm
+    import seqtrace.core.bayes.nbbayes as nbbayes
+except ImportError:
+    # if that fails, the tests of the Numba implementation are skipped
+    nbbayes = None
+try:
+    # try to load the compiled Cython implementation of the Bayesian consensus algorithm
+    import seqtrace.core.bayes.cbayes as cbayes
+except ImportError:
+    # if that fails, the tests of the Cython implementation are skipped
+    cbayes = None
 
 import unittest
 
@@ -114,6 +127,32 @@ class TestConsensus(unittest.TestCase):
 
         self.assertEqual(cons.getNumSeqs(), 1)
 
+    def test_settingsSetAll(self):
+        """
+        Tests that setAll() sends each settings change event only once.
+        """
+        def recorder(event_name):
+            return lambda *args: events.append((event_name, args))
+
+        events = []
+        settings = ConsensSeqSettings()
+        for event_name in ('settings_change', 'min_confscore_change', 'autotrim_change',
+                'consensus_algorithm_change'):
+            settings.registerObserver(event_name, recorder(event_name))
+
+        settings.setAll(20, 'legacy', False, True, True, 0.5, 'AAT', 'TTA', False, (12, 9))
+        self.assertEqual(events, [('min_confscore_change', (20, 30)), ('consensus_algorithm_change', ()),
+            ('autotrim_change', ()), ('settings_change', ())])
+
+        # Nothing should be sent if none of the settings change.
+        events = []
+        settings.setAll(20, 'legacy', False, True, True, 0.5, 'AAT', 'TTA', False, (12, 9))
+        self.assertEqual(events, [])
+
+        # Individual setters should still send their events immediately.
+        settings.setTrimEndGaps(False)
+        self.assertEqual(events, [('autotrim_change', ()), ('settings_change', ())])
+
     def test_singleConsensus(self):
         """
         Test consensus sequence construction on a single sequence trace.
@@ -155,7 +194,7 @@ class TestConsensus(unittest.TestCase):
         and quality score.
         """
         cons = ConsensSeqBuilder((self.seqt1,), self.settings)
-        nppd = {'A': 0.0, 'T': 0.0, 'G': 0.0, 'C': 0.0}
+        nppd = [0.0] * 4
 
         # Define some test cases and expected results.  Includes test cases for all
         # IUPAC ambiguity codes.
@@ -201,11 +240,11 @@ class TestConsensus(unittest.TestCase):
             cons.defineBasePrDist(case['call'], case['quality'], nppd)
 
             # Verify that the probabilities sum to 1.
-            self.assertAlmostEqual(sum(nppd.values()), 1.0)
+            self.assertAlmostEqual(sum(nppd), 1.0)
 
             # Verify that the individual probabilities are correct.
-            for base in ('A', 'T', 'G', 'C'):
-                self.assertAlmostEqual(result[base], nppd[base])
+            for (index, base) in enumerate(('A', 'T', 'G', 'C')):
+                self.assertAlmostEqual(result[base], nppd[index])
 
     def test_calcPosteriorBasePrDist(self):
         """
@@ -213,7 +252,8 @@ class TestConsensus(unittest.TestCase):
         Theorem on two separate base calls and quality scores.
         """
         cons = ConsensSeqBuilder((self.seqt1,), self.settings)
-        nppd = {'A': 0.0, 'T': 0.0, 'G': 0.0, 'C': 0.0}
+        nppd = [0.0] * 4
+        prior = [0.0] * 4
 
         # Define some test cases and expected results.
         cases = [
@@ -243,10 +283,10 @@ class TestConsensus(unittest.TestCase):
 
         # Try each test case.
         for (case, result) in zip(cases, results):
-            cons.calcPosteriorBasePrDist(case['call1'], case['qual1'], case['call2'], case['qual2'], nppd)
+            cons.calcPosteriorBasePrDist(case['call1'], case['qual1'], case['call2'], case['qual2'], nppd, prior)
             #print nppd
-            for base in ('A', 'T', 'G', 'C'):
-                self.assertAlmostEqual(result[base], nppd[base])
+            for (index, base) in enumerate(('A', 'T', 'G', 'C')):
+                self.assertAlmostEqual(result[base], nppd[index])
 
     def test_getGapFlankingScore(self):
         """
@@ -642,6 +682,66 @@ class TestConsensus(unittest.TestCase):
             cons.trimConsensus(testcase[1], testcase[2])
             self.assertEqual(cons.getConsensus(), testcase[3])
 
+    def test_trimWindowScans(self):
+        """
+        Verifies that the NumPy and Numba window scans for quality trimming give the
+        same results as the native Python trimConsensus().
+        """
+        if consens.numpy is None:
+            self.skipTest('NumPy is not available.')
+        numpy = consens.numpy
+
+        cons = ConsensSeqBuilder((self.seqt1,), self.settings)
+
+        # Test cases: [consensus, window size, base count].
+        cases = [
+                ['NNNNNNNN', 3, 1],         # no qualifying window
+                ['  ANANAN ', 3, 3],        # no qualifying window, with spaces
+                ['AAGTC', 5, 5],            # window size equals the sequence length
+                ['AAGNC', 5, 5],            # same, but with no qualifying window
+                ['NNAAAANN', 4, 4],         # the first and last windows are the same
+                ['N AAA AAN', 4, 4],        # the first and last windows overlap
+                ['NAANAAAGNNA', 3, 2],
+                ['ATGNNNNC', 2, 0],         # every window qualifies
+                ['NNWSNRYNNBD VNNN', 4, 3]  # ambiguity codes
+                ]
+
+        for (consensus, winsize, basecnt) in cases:
+            # Get the result of the native Python algorithm.
+            savednumpy = consens.numpy
+            consens.numpy = None
+            try:
+                cons.consensus = consensus
+                cons.trimConsensus(winsize, basecnt)
+            finally:
+                consens.numpy = savednumpy
+            expected = cons.consensus
+
+            # Run the window scans on the good base calls of the consensus sequence.
+            compcons = consensus.replace(' ', '')
+            good = numpy.array([base != 'N' for base in compcons])
+            windows = cons.findTrimWindowsNumPy(good, winsize, basecnt)
+            if nbbayes is not None:
+                self.assertEqual(nbbayes.findTrimWindows(good.view(numpy.uint8), winsize, basecnt), windows)
+
+            # Check the windows against the trimmed consensus sequence.
+            trimmed = expected.replace(' ', '')
+            if windows == (-1, -1):
+                self.assertEqual(trimmed, '')
+            else:
+                self.assertEqual(compcons[windows[0]:windows[1] + winsize], trimmed)
+
+            # Check the NumPy trimming with both window scans.
+            savedscan = consens.findTrimWindows
+            for scan in (savedscan, None):
+                consens.findTrimWindows = scan
+                try:
+                    cons.consensus = consensus
+                    cons.trimConsensus(winsize, basecnt)
+                finally:
+                    consens.findTrimWindows = savedscan
+                self.assertEqual(cons.consensus, expected)
+
     def test_consensusWithEndTrimming(self):
         """
         Tests consensus construction with end trimming by testing a bunch of different
@@ -1008,6 +1108,159 @@ class TestConsensus(unittest.TestCase):
 
         self.seqt8.isreverse_comped = False
 
+    def test_NumPyAlgorithms(self):
+        """
+        Verifies that the NumPy implementations of the consensus and trimming algorithms
+        produce the same results as the native Python implementations.
+        """
+        if consens.numpy is None:
+            self.skipTest('NumPy is not available.')
+
+        self.settings.setTrimEndGaps(True)
+        self.settings.setDoQualityTrim(True)
+        self.settings.setQualityTrimParams(4, 3)
+
+        tracesets = [(self.seqt1,), (self.seqt6,), (self.seqt1, self.seqt2), (self.seqt4, self.seqt5),
+                (self.seqt10, self.seqt11), (self.seqt6, self.seqt7), (self.seqt8, self.seqt9)]
+
+        # Test the NumPy implementations both with the compiled Bayesian column loop,
+        # if one is available, and without it.
+        savedkernel = consens.bayesianConsensus
+        for kernel in (savedkernel, None):
+            consens.bayesianConsensus = kernel
+            try:
+                self.compareNumPyAlgorithms(tracesets)
+            finally:
+                consens.bayesianConsensus = savedkernel
+
+    def compareNumPyAlgorithms(self, tracesets):
+        for algorithm in ('Bayesian', 'legacy'):
+            self.settings.setConsensusAlgorithm(algorithm)
+            for minscore in (10, 20, 30):
+                self.settings.setMinConfScore(minscore)
+                for traces in tracesets:
+                    cons = ConsensSeqBuilder(traces, self.settings)
+                    npresult = (cons.getConsensus(), [round(cval, 4) for cval in cons.consconf])
+
+                    # Rebuild the consensus sequence without NumPy.
+                    savednumpy = consens.numpy
+                    consens.numpy = None
+                    try:
+                        cons.makeConsensusSequence()
+                    finally:
+                        consens.numpy = savednumpy
+                    pyresult = (cons.getConsensus(), [round(cval, 4) for cval in cons.consconf])
+
+                    self.assertEqual(npresult, pyresult)
+
+    def test_posteriorTables(self):
+        """
+        Verifies that the posterior lookup tables used by the NumPy Bayesian consensus
+        algorithm match the native Python calculations, and that scores outside of the
+        tables are handled by calculating the results.
+        """
+        if consens.numpy is None:
+            self.skipTest('NumPy is not available.')
+
+        cons = ConsensSeqBuilder((self.seqt1,), self.settings)
+        cons.buildPosteriorTables()
+        self.assertEqual(cons.posterior_bases.shape, (4, 4, 62, 62))
+        self.assertEqual(cons.posterior_scores.shape, (4, 4, 62, 62))
+
+        nppd = [0.0] * 4
+        prior = [0.0] * 4
+        for base1 in ('A', 'T', 'G', 'C'):
+            for base2 in ('A', 'T', 'G', 'C'):
+                for score1 in (0, 1, 30, 61):
+                    for score2 in (0, 20, 61):
+                        cons.calcPosteriorBasePrDist(base1, score1, base2, score2, nppd, prior)
+                        cbase, cscore = cons.getMostProbableBase(nppd)
+
+                        index = ('ATGC'.index(base1), 'ATGC'.index(base2), score1, score2)
+                        self.assertEqual(chr(cons.posterior_bases[index]), cbase)
+                        self.assertAlmostEqual(cons.posterior_scores[index], cscore)
+
+        # Use scores of 0, 61, and 62 in an alignment of unambiguous base calls; the
+        # columns with a score of 62 are not in the tables.
+        self.settings.setTrimConsensus(False)
+        self.settings.setConsensusAlgorithm('Bayesian')
+        self.settings.setMinConfScore(30)
+        self.seqt10.bcconf = [62, 61, 0, 62, 62, 61, 62, 0, 20, 62, 61, 62, 0, 62, 61]
+        self.seqt11.bcconf = [62, 0, 61, 62, 62, 62, 0, 61, 62, 62, 61, 62, 0]
+
+        savedkernel = consens.bayesianConsensus
+        consens.bayesianConsensus = None
+        try:
+            cons = ConsensSeqBuilder((self.seqt10, self.seqt11), self.settings)
+        finally:
+            consens.bayesianConsensus = savedkernel
+        npresult = (cons.getConsensus(), cons.consconf)
+
+        savednumpy = consens.numpy
+        consens.numpy = None
+        try:
+            cons.makeConsensusSequence()
+        finally:
+            consens.numpy = savednumpy
+
+        self.assertEqual(npresult[0], cons.getConsensus())
+        for (npscore, score) in zip(npresult[1], cons.consconf):
+            self.assertAlmostEqual(npscore, score)
+
+    def checkCompiledBayesianConsensus(self, bayesmodule):
+        """
+        Verifies that the compiled Bayesian consensus column loop in bayesmodule
+        produces the same results as the native Python implementation.
+        """
+        if consens.numpy is None:
+            self.skipTest('NumPy is not available.')
+        numpy = consens.numpy
+
+        self.settings.setTrimConsensus(False)
+        self.settings.setForwardPrimer('')
+        self.settings.setReversePrimer('')
+        self.settings.setConsensusAlgorithm('Bayesian')
+
+        tracesets = [(self.seqt4, self.seqt5), (self.seqt5, self.seqt4), (self.seqt10, self.seqt11),
+                (self.seqt11, self.seqt10), (self.seqt6, self.seqt7), (self.seqt8, self.seqt9)]
+
+        for minscore in (10, 20, 30):
+            self.settings.setMinConfScore(minscore)
+            for traces in tracesets:
+                # Build the consensus sequence with the native Python implementation.
+                savednumpy = consens.numpy
+                consens.numpy = None
+                try:
+                    cons = ConsensSeqBuilder(traces, self.settings)
+                finally:
+                    consens.numpy = savednumpy
+
+                # Run the compiled column loop on the same alignment.
+                seq1 = numpy.frombuffer(cons.alignedseqs[0], dtype=numpy.uint8)
+                seq2 = numpy.frombuffer(cons.alignedseqs[1], dtype=numpy.uint8)
+                scores1 = numpy.array(cons.alignedscores[0], dtype=numpy.int16)
+                scores2 = numpy.array(cons.alignedscores[1], dtype=numpy.int16)
+                gapflankscores = cons.getGapFlankingScoreArray(seq1, seq2)
+                bcons, bconsconf = bayesmodule.bayesianConsensus(
+                        seq1, scores1, seq2, scores2, gapflankscores, minscore)
+
+                self.assertEqual(numpy.asarray(bcons).tobytes(), cons.getConsensus())
+                self.assertEqual(len(bconsconf), len(cons.consconf))
+                for (bscore, score) in zip(bconsconf, cons.consconf):
+                    self.assertAlmostEqual(bscore, score)
+
+    def test_nbbayesConsensus(self):
+        if nbbayes is None:
+            self.skipTest('The Numba implementation could not be loaded.')
+
+        self.checkCompiledBayesianConsensus(nbbayes)
+
+    def test_cbayesConsensus(self):
+        if cbayes is None:
+            self.skipTest('The Cython implementation could not be loaded.')
+
+        self.checkCompiledBayesianConsensus(cbayes)
+
 
 
 class TestModifiableConsensus(unittest.TestCase):
@@ -1105,6 +1358,26 @@ class TestModifiableConsensus(unittest.TestCase):
         self.cons.redo()
         self.assertEqual(self.cons.getConsensus(), self.seqt1.getBaseCalls())
 
+    def test_recalcConsensusSequence(self):
+        changes = []
+        self.cons.registerObserver('consensus_changed', lambda start, end: changes.append((start, end)))
+
+        # Nothing has changed, so the consensus sequence should not be recalculated.
+        self.cons.recalcConsensusSequence()
+        self.assertEqual(changes, [])
+
+        # After an edit, the consensus sequence should be recalculated.
+        self.cons.deleteBases(0, 3)
+        self.cons.recalcConsensusSequence()
+        self.assertEqual(changes, [(0, 3), (0, 21)])
+        self.assertEqual(self.cons.getConsensus(), self.seqt1.getBaseCalls())
+
+        # Changing a setting should also cause the consensus sequence to be recalculated.
+        self.settings.setMinConfScore(10)
+        self.cons.recalcConsensusSequence()
+        self.assertEqual(changes, [(0, 3), (0, 21), (0, 21)])
+        self.assertEqual(self.cons.getConsensus(), 'NNGCTANCTGACATGATTTACG')
+
 
 
 
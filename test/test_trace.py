@@ -182,6 +182,7 @@ class TestSequenceTrace:
         # test if the confidence scores are correct
         for cnt in range(len(self.bc_conf)):
             self.assertEqual(self.trace.getBaseCallConf(cnt), self.bc_conf[cnt])
+        self.assertEqual(self.trace.getBaseCallConfs(range(len(self.bc_conf))), list(self.bc_conf))
 
         # test if the loaded trace values are correct (only tests the first 800 sample values)
         for cnt in range(len(self.start_tracesamps_A)):